@@ -1,11 +1,65 @@
 import os
+import ast
+import io
+import mmap
 import json
 import re
-from typing import Dict, List, Optional
-from dataclasses import dataclass
+import time
+import random
+import sqlite3
+import tempfile
+import asyncio
+import hashlib
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+from dataclasses import asdict, dataclass, replace
 from enum import Enum
 
 from google import genai
+from google.genai import errors
+
+
+# Status codes worth retrying: rate limiting and transient server errors.
+RETRYABLE_STATUS_CODES = {429, 500, 503}
+MAX_RETRIES = 5
+
+DEFAULT_MODEL = "gemini-2.5-flash"
+
+# Batch jobs run asynchronously on Gemini's side and are polled until done,
+# or until the max wait passes and the remaining work is done online.
+BATCH_POLL_SECONDS = 30
+BATCH_MAX_WAIT_SECONDS = 2 * 3600
+# Gemini caps inline batch requests at ~20 MB; larger jobs go through the Files API.
+BATCH_INLINE_LIMIT_BYTES = 16 * 1024 * 1024
+BATCH_DONE_STATES = {
+    "JOB_STATE_SUCCEEDED",
+    "JOB_STATE_FAILED",
+    "JOB_STATE_CANCELLED",
+    "JOB_STATE_EXPIRED",
+}
+
+# Shared decoder; avoids building a JSONDecoder (and its scanner) per response.
+_JSON_DECODER = json.JSONDecoder()
+
+# Files above this estimated size are split and reviewed chunk by chunk.
+MAX_CHUNK_TOKENS = 4000
+CHARS_PER_TOKEN = 4
+
+# Larger files are memory-mapped instead of read into a heap buffer.
+MMAP_THRESHOLD = 256 * 1024
+
+# Start of a JSON object with a key, so stray braces in leading prose are skipped.
+# Compiled once; the pattern has no nested quantifiers and scans in linear time.
+_JSON_START_RE = re.compile(r'\{\s*"')
+
+# Clean files usually come back with no issues or suggestions. Only a response
+# that is exactly that object (in schema key order) skips the full decode;
+# anything else, including nested lookalikes, goes through the decoder.
+_EMPTY_REVIEW_RE = re.compile(
+    r'\{\s*"issues"\s*:\s*\[\s*\]\s*,'
+    r'\s*"suggestions"\s*:\s*\[\s*\]\s*,'
+    r'\s*"quality_score"\s*:\s*(-?\d+)\s*,'
+    r'\s*"summary"\s*:\s*("(?:[^"\\]|\\.)*")\s*\}'
+)
 
 
 # ============================ MODELS ============================ #
@@ -16,19 +70,516 @@ class ReviewType(Enum):
     SECURITY = "security"
 
 
-@dataclass
+@dataclass(slots=True)
 class CodeReview:
     file_path: str
     issues: List[Dict]
     suggestions: List[Dict]
     quality_score: int
     summary: str
+    # True when the model output could not be parsed and this is the fallback review.
+    parse_failed: bool = False
+
+
+# ============================ PROMPTS ============================ #
+
+_PROMPT_PREFIX_TEMPLATE = """
+You are an expert software reviewer.
+
+Focus: {focus}
+
+Return ONLY raw JSON.
+Do NOT include markdown, explanations, or commentary.
+
+Required JSON format:
+{{
+  "issues": [
+    {{
+      "type": "security|bug|style|performance",
+      "line": 10,
+      "message": "description",
+      "severity": "low|medium|high|critical",
+      "cwe": "CWE-XXX"
+    }}
+  ],
+  "suggestions": [
+    {{
+      "category": "security|performance|style",
+      "message": "suggestion text",
+      "priority": "low|medium|high"
+    }}
+  ],
+  "quality_score": 85,
+  "summary": "short summary"
+}}
+"""
+
+_PROMPT_BODY_TEMPLATE = """
+File: {file_path}
+
+Code:
+```
+{code}
+```
+"""
+
+_PROMPT_CHUNK_TEMPLATE = """
+File: {file_path} (part {part} of {parts}, lines {first_line}-{last_line})
+
+Line numbers in your answer are counted from the first line of the Code block.
+{context}
+Code:
+```
+{code}
+```
+"""
+
+_PROMPT_CONTEXT_TEMPLATE = """
+Module imports (context only, do not review):
+```
+{imports}
+```
+"""
+
+_REVIEW_FOCUS = {
+    ReviewType.QUICK: "Quick overall review",
+    ReviewType.DETAILED: "Detailed quality and design review",
+    ReviewType.SECURITY: "Strict security vulnerability review",
+}
+
+# The instructions never change between files, so they are built once and sent
+# first; only the file block varies. Gemini's implicit caching reuses a shared
+# leading prefix automatically, so no explicit context cache is managed here.
+PROMPT_PREFIXES = {
+    review_type: _PROMPT_PREFIX_TEMPLATE.format(focus=focus)
+    for review_type, focus in _REVIEW_FOCUS.items()
+}
+
+# Indexed reviews are only valid for the prompts and chunking that produced them.
+# Bump REVIEW_FORMAT_VERSION for splitter or parser changes the templates don't show.
+REVIEW_FORMAT_VERSION = 1
+PROMPT_VERSION = hashlib.sha256(
+    "\0".join([
+        str(REVIEW_FORMAT_VERSION),
+        str(MAX_CHUNK_TOKENS),
+        _PROMPT_BODY_TEMPLATE,
+        _PROMPT_CHUNK_TEMPLATE,
+        _PROMPT_CONTEXT_TEMPLATE,
+        *PROMPT_PREFIXES.values(),
+    ]).encode("utf-8")
+).hexdigest()[:16]
+
+
+# ============================ SPLITTER ============================ #
+
+# A chunk is (first line number, source text).
+Chunk = Tuple[int, str]
+
+
+def _source_lines(code: str) -> List[str]:
+    """Split into lines the way the tokenizer does: only on LF, CRLF and CR.
+
+    str.splitlines also breaks on form feeds, U+2028 and similar characters,
+    which would put ast line numbers and list indices out of step.
+    """
+    return io.StringIO(code, newline="").readlines()
+
+
+def _hard_split(first_line: int, lines: List[str], budget: int) -> List[Chunk]:
+    """Split an oversized segment on line boundaries, preferring blank lines.
+
+    A single line longer than the budget (minified code, bundles) is cut at
+    budget-sized character offsets; every piece keeps that line's number.
+    """
+    pieces: List[Tuple[int, str]] = []
+    for offset, line in enumerate(lines):
+        for pos in range(0, len(line), budget):
+            pieces.append((first_line + offset, line[pos:pos + budget]))
+
+    chunks: List[Chunk] = []
+    start = 0
+    size = 0
+    last_blank = -1
+
+    for i, (_, text) in enumerate(pieces):
+        while size + len(text) > budget and i > start:
+            cut = last_blank + 1 if last_blank >= start else i
+            chunks.append((pieces[start][0], "".join(t for _, t in pieces[start:cut])))
+            size = sum(len(t) for _, t in pieces[cut:i])
+            start = cut
+        size += len(text)
+        if not text.strip():
+            last_blank = i
+
+    if start < len(pieces):
+        chunks.append((pieces[start][0], "".join(t for _, t in pieces[start:])))
+    return chunks
+
+
+def _pack_segments(lines: List[str], starts: List[int], budget: int) -> List[Chunk]:
+    """Greedily merge consecutive segments (given by 0-based start lines) up to budget."""
+    bounds = sorted(set(starts) | {0})
+    segments = [
+        (begin, lines[begin:end])
+        for begin, end in zip(bounds, bounds[1:] + [len(lines)])
+        if begin < end
+    ]
+
+    chunks: List[Chunk] = []
+    current_start = 0
+    current: List[str] = []
+    current_size = 0
+
+    for begin, seg_lines in segments:
+        seg_size = sum(len(l) for l in seg_lines)
+        if seg_size > budget:
+            # Fold the pending small segments into the hard split rather than
+            # leaving them as a tiny chunk of their own.
+            if current:
+                begin, seg_lines = current_start, current + seg_lines
+                current, current_size = [], 0
+            chunks.extend(_hard_split(begin + 1, seg_lines, budget))
+            continue
+
+        if current and current_size + seg_size > budget:
+            chunks.append((current_start + 1, "".join(current)))
+            current, current_size = [], 0
+
+        if not current:
+            current_start = begin
+        current.extend(seg_lines)
+        current_size += seg_size
+
+    if current:
+        chunks.append((current_start + 1, "".join(current)))
+    return chunks
+
+
+def _python_boundaries(code: str) -> Optional[Tuple[List[int], str]]:
+    """Start lines of top-level defs/classes and the module's import lines."""
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError, RecursionError, MemoryError):
+        return None  # not parseable here; the blank-line/brace split still applies
+
+    lines = _source_lines(code)
+    starts: List[int] = []
+    imports: List[str] = []
+
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            first = min([node.lineno] + [d.lineno for d in node.decorator_list])
+            starts.append(first - 1)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            imports.extend(lines[node.lineno - 1:node.end_lineno])
+
+    return starts, "".join(imports)
+
+
+def _brace_boundaries(lines: List[str]) -> List[int]:
+    """Lines following a blank line at brace depth zero (C-like languages)."""
+    starts: List[int] = []
+    depth = 0
+
+    for i, line in enumerate(lines):
+        if not line.strip():
+            if depth <= 0:
+                starts.append(i + 1)
+            continue
+        depth += line.count("{") - line.count("}")
+
+    return starts
+
+
+def _split_for_review(code: str, path: str) -> Tuple[List[Chunk], str]:
+    """Split source that exceeds the token budget; returns (chunks, shared imports)."""
+    budget = MAX_CHUNK_TOKENS * CHARS_PER_TOKEN
+    if len(code) <= budget:
+        return [(1, code)], ""
+
+    lines = _source_lines(code)
+    imports = ""
+    parsed = _python_boundaries(code) if path.endswith(".py") else None
+
+    if parsed is not None:
+        starts, imports = parsed
+    else:
+        starts = _brace_boundaries(lines)
+
+    chunks = _pack_segments(lines, starts, budget)
+    # Blank runs between segments would only cost a request that finds nothing.
+    return [c for c in chunks if c[1].strip()] or chunks[:1], imports
+
+
+def _merge_reviews(file_path: str, parts: List[Tuple[Chunk, "CodeReview"]]) -> "CodeReview":
+    """Combine per-chunk reviews, shifting issue lines back to file coordinates.
+
+    The quality score is averaged by chunk length, so a short tail chunk
+    does not count as much as the bulk of the file.
+    """
+    issues: List[Dict] = []
+    suggestions: List[Dict] = []
+
+    for (first_line, _), review in parts:
+        for issue in review.issues:
+            line = issue.get("line") if isinstance(issue, dict) else None
+            if isinstance(line, int) and line > 0:
+                issue = {**issue, "line": line + first_line - 1}
+            issues.append(issue)
+        suggestions.extend(review.suggestions)
+
+    return CodeReview(
+        file_path=file_path,
+        issues=issues,
+        suggestions=suggestions,
+        quality_score=round(
+            sum(len(code) * r.quality_score for (_, code), r in parts)
+            / max(sum(len(code) for (_, code), _ in parts), 1)
+        ),
+        summary=" ".join(r.summary for _, r in parts if r.summary),
+        parse_failed=any(r.parse_failed for _, r in parts),
+    )
+
+
+# ============================ FILE DISCOVERY ============================ #
+
+def _iter_source_files(directory: str, exts: Tuple[str, ...]) -> Iterator[str]:
+    """Yield matching file paths under directory; DirEntry avoids a stat per entry."""
+    try:
+        with os.scandir(directory) as it:
+            entries = list(it)
+    except OSError:
+        return  # unreadable directory, skipped like os.walk does
+
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from _iter_source_files(entry.path, exts)
+        elif entry.name.endswith(exts) and entry.is_file():
+            yield entry.path
+
+
+def _read_source(path: str) -> Tuple[str, bytes]:
+    """Read a file once as bytes; returns (decoded text, SHA-256 digest of the bytes)."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size > MMAP_THRESHOLD:
+            # Hash and decode straight from the page cache, without a bytes copy.
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return str(mm, "utf-8", "ignore"), hashlib.sha256(mm).digest()
+
+        data = f.read()
+    return data.decode("utf-8", errors="ignore"), hashlib.sha256(data).digest()
+
+
+# ============================ REPORT HELPERS ============================ #
+
+def _percentile(sorted_scores: List[int], q: float) -> float:
+    """Linearly interpolated percentile of an already sorted, non-empty list."""
+    pos = (len(sorted_scores) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_scores) - 1)
+    return sorted_scores[lo] + (sorted_scores[hi] - sorted_scores[lo]) * (pos - lo)
+
+
+_REVIEW_HEADER = "## %s\n\nScore: %d/100\n\n%s\n\n".__mod__
+_ITEMS_SECTION = "### %s\n- %s\n\n".__mod__
+
+# json.dumps(..., ensure_ascii=False) would build a new encoder on every call.
+_encode_item = json.JSONEncoder(ensure_ascii=False).encode
+
+
+def _render_items(title: str, items: List[Dict]) -> str:
+    return _ITEMS_SECTION((title, "\n- ".join(map(_encode_item, items))))
+
+
+# ============================ CACHE ============================ #
+
+class ResponseCache:
+    """On-disk cache of raw Gemini responses, keyed by a hash of (model, prompt)."""
+
+    def __init__(self, path: str = "data/llm_cache.json", ttl: Optional[float] = None):
+        self.path = path
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0}
+        self._entries: Dict[str, Dict] = {}
+        self._dirty = False
+
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = {}
+            # Anything malformed (hand edits, an older layout) is a miss, not a crash.
+            if isinstance(data, dict):
+                self._entries = {k: v for k, v in data.items() if self._is_valid(v)}
+                self._dirty = len(self._entries) != len(data)
+
+    @staticmethod
+    def make_key(model: str, prompt: str) -> str:
+        return hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _is_valid(entry) -> bool:
+        return (
+            isinstance(entry, dict)
+            and isinstance(entry.get("text"), str)
+            and isinstance(entry.get("created"), (int, float))
+            and not isinstance(entry["created"], bool)
+        )
+
+    def _is_fresh(self, entry: Dict) -> bool:
+        age = time.time() - entry["created"]
+        # A timestamp in the future (clock skew, hand-edited file) is never fresh.
+        return age >= 0 and (self.ttl is None or age <= self.ttl)
+
+    def __contains__(self, key: str) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and self._is_fresh(entry)
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is not None and self._is_fresh(entry):
+            self.stats["hits"] += 1
+            return entry["text"]
+
+        self.stats["misses"] += 1
+        return None
+
+    def set(self, key: str, text: str):
+        self._entries[key] = {"text": text, "created": time.time()}
+        self._dirty = True
+
+    def discard(self, key: str):
+        if self._entries.pop(key, None) is not None:
+            self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+
+        entries = {k: v for k, v in self._entries.items() if self._is_fresh(v)}
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+
+class ReviewIndex:
+    """SQLite index of finished reviews keyed by (path, review type, model, mtime, size)."""
+
+    # Bump when the table layout changes; older tables are dropped and rebuilt.
+    SCHEMA_VERSION = 2
+
+    def __init__(self, path: str = ".review_cache/index.sqlite", ttl: Optional[float] = None):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0}
+        self._conn = sqlite3.connect(path, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+            self._conn.execute("DROP TABLE IF EXISTS reviews")
+            self._conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS reviews (
+                path TEXT NOT NULL,
+                review_type TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_version TEXT NOT NULL,
+                mtime INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                review TEXT NOT NULL,
+                PRIMARY KEY (path, review_type, model)
+            )
+            """
+        )
+
+    def _is_fresh(self, created: float) -> bool:
+        age = time.time() - created
+        return age >= 0 and (self.ttl is None or age <= self.ttl)
+
+    def _lookup(
+        self, path: str, review_type: ReviewType, model: str, stat: os.stat_result
+    ) -> Optional[CodeReview]:
+        row = self._conn.execute(
+            "SELECT created, review FROM reviews"
+            " WHERE path = ? AND review_type = ? AND model = ? AND prompt_version = ?"
+            " AND mtime = ? AND size = ?",
+            (path, review_type.value, model, PROMPT_VERSION, stat.st_mtime_ns, stat.st_size),
+        ).fetchone()
+
+        if row is not None and self._is_fresh(row[0]):
+            try:
+                review = CodeReview(**json.loads(row[1]))
+            except (TypeError, ValueError):
+                review = None  # malformed row; re-review
+            if review is not None and not review.parse_failed:
+                return review
+        return None
+
+    def has(self, path: str, review_type: ReviewType, model: str, stat: os.stat_result) -> bool:
+        """Like get, but without counting towards the hit/miss stats."""
+        return self._lookup(path, review_type, model, stat) is not None
+
+    def get(
+        self, path: str, review_type: ReviewType, model: str, stat: os.stat_result
+    ) -> Optional[CodeReview]:
+        review = self._lookup(path, review_type, model, stat)
+        self.stats["hits" if review is not None else "misses"] += 1
+        return review
+
+    def set(
+        self,
+        path: str,
+        review_type: ReviewType,
+        model: str,
+        stat: os.stat_result,
+        review: CodeReview,
+    ):
+        # A fallback review for unparseable output must not pin the file until it changes.
+        if review.parse_failed:
+            return
+
+        self._conn.execute(
+            "INSERT OR REPLACE INTO reviews VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                path,
+                review_type.value,
+                model,
+                PROMPT_VERSION,
+                stat.st_mtime_ns,
+                stat.st_size,
+                time.time(),
+                json.dumps(asdict(review), ensure_ascii=False),
+            ),
+        )
+
+    def close(self):
+        self._conn.close()
 
 
 # ============================ REVIEWER ============================ #
 
 class AICodeReviewer:
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        cache: Optional[ResponseCache] = None,
+        concurrency: int = 8,
+        index: Optional[ReviewIndex] = None,
+        model: str = DEFAULT_MODEL,
+    ):
         self.api_key = api_key or os.getenv("GEMINI_API_KEY")
         if not self.api_key:
             raise RuntimeError(
@@ -36,29 +587,245 @@ class AICodeReviewer:
             )
 
         self.client = genai.Client(api_key=self.api_key)
-        self.model = "gemini-2.5-flash"
+        self.model = model
+        self.cache = cache
+        self.index = index
+
+        # Bound in-flight requests to stay within Gemini quotas.
+        self.concurrency = max(1, concurrency)
+        self._request_slots = asyncio.Semaphore(self.concurrency)
+
+        # Responses fetched ahead of time by a batch job, keyed like ResponseCache.
+        self._prefetched: Dict[str, str] = {}
+
+        # How many responses took the empty-review fast path vs a full decode.
+        self.parse_stats = {"fast": 0, "full": 0}
+
+    async def aclose(self):
+        # Every request shares the async client's pooled keep-alive connections;
+        # release them explicitly instead of leaving it to interpreter shutdown.
+        close = getattr(self.client.aio, "aclose", None)
+        if close is not None:
+            await close()
 
     # ---------------- GEMINI CALL ---------------- #
 
-    def _call_gemini(self, prompt: str) -> str:
+    async def _stream_text(self, contents: str) -> str:
+        chunks: List[str] = []
+        stream = await self.client.aio.models.generate_content_stream(
+            model=self.model,
+            contents=contents,
+        )
+        async for chunk in stream:
+            if chunk.text:
+                chunks.append(chunk.text)
+        return "".join(chunks)
+
+    async def _generate_with_retry(self, contents: str) -> str:
+        delay = 1.0
+        for attempt in range(MAX_RETRIES):
+            try:
+                return await self._stream_text(contents)
+            except errors.APIError as e:
+                if e.code not in RETRYABLE_STATUS_CODES or attempt == MAX_RETRIES - 1:
+                    raise RuntimeError("Gemini API call failed") from e
+            except Exception as e:
+                raise RuntimeError("Gemini API call failed") from e
+
+            # Exponential backoff with jitter so concurrent workers don't retry in lockstep.
+            await asyncio.sleep(delay + random.uniform(0, delay))
+            delay *= 2
+
+    def _response_key(self, review_type: ReviewType, body: str) -> str:
+        return ResponseCache.make_key(self.model, PROMPT_PREFIXES[review_type] + body)
+
+    async def _call_gemini(self, review_type: ReviewType, body: str) -> Tuple[str, bool]:
+        """Return (response text, whether it came from the response cache)."""
+        prefix = PROMPT_PREFIXES[review_type]
+
+        key = self._response_key(review_type, body)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached, True
+
+        text = self._prefetched.pop(key, None)
+        if text is not None:
+            return text, False
+
+        async with self._request_slots:
+            text = await self._generate_with_retry(prefix + body)
+
+        return text, False
+
+    # ---------------- BATCH PREFETCH ---------------- #
+
+    async def _prefetch_batch(
+        self,
+        paths: List[str],
+        review_type: ReviewType,
+        timeout: float = BATCH_MAX_WAIT_SECONDS,
+    ) -> Dict[bytes, str]:
+        """Fetch every uncached prompt under paths with one batch job.
+
+        Returns {content digest: path whose prompts were submitted}, so the online
+        pass builds the same prompts (and cache keys) for duplicated contents.
+        """
+        prefix = PROMPT_PREFIXES[review_type]
+        owners: Dict[bytes, str] = {}
+        keys: List[str] = []
+        load_slots = asyncio.Semaphore(self.concurrency)
+
+        fd, jsonl_path = tempfile.mkstemp(prefix="code-review-", suffix=".jsonl")
+        uploaded = None
         try:
-            response = self.client.models.generate_content(
+            # Prompts are spooled to disk as they are built, so only about
+            # `concurrency` sources are in memory at once.
+            with os.fdopen(fd, "w", encoding="utf-8") as out:
+
+                async def _collect(path: str):
+                    async with load_slots:
+                        # Any failure just leaves the file out of the job; the
+                        # online pass reviews it again and reports the error.
+                        try:
+                            stat = os.stat(path)
+                            if self.index is not None and self.index.has(
+                                path, review_type, self.model, stat
+                            ):
+                                return
+                            code, digest = await asyncio.to_thread(_read_source, path)
+                            if digest in owners:
+                                return
+
+                            entries = []
+                            for _, body in self._review_prompts(code, path):
+                                key = self._response_key(review_type, body)
+                                if self.cache is not None and key in self.cache:
+                                    continue
+                                request = {"contents": [{"role": "user", "parts": [{"text": prefix + body}]}]}
+                                entries.append((key, json.dumps({"key": key, "request": request}, ensure_ascii=False)))
+                        except Exception:
+                            return
+
+                        owners[digest] = path
+                        for key, line in entries:
+                            out.write(line)
+                            out.write("\n")
+                            keys.append(key)
+
+                await asyncio.gather(*[_collect(p) for p in paths])
+
+            if not keys:
+                return owners
+
+            if os.path.getsize(jsonl_path) <= BATCH_INLINE_LIMIT_BYTES:
+                with open(jsonl_path, "r", encoding="utf-8") as f:
+                    src = [json.loads(line)["request"] for line in f]
+            else:
+                uploaded = await self.client.aio.files.upload(
+                    file=jsonl_path,
+                    config={"display_name": "code-review-batch", "mime_type": "jsonl"},
+                )
+                src = uploaded.name
+
+            job = await self.client.aio.batches.create(
                 model=self.model,
-                contents=prompt,
+                src=src,
+                config={"display_name": "code-review"},
             )
-            return response.text
+            print(f"… Submitted batch {job.name} with {len(keys)} requests")
+
+            started = time.monotonic()
+            while job.state.name not in BATCH_DONE_STATES:
+                remaining = timeout - (time.monotonic() - started)
+                if remaining <= 0:
+                    try:
+                        await self.client.aio.batches.cancel(name=job.name)
+                    except Exception:
+                        pass  # the job's output is simply never used
+                    raise RuntimeError(f"batch still {job.state.name} after {timeout:.0f}s")
+
+                await asyncio.sleep(min(BATCH_POLL_SECONDS, remaining))
+                job = await self.client.aio.batches.get(name=job.name)
+                elapsed = time.monotonic() - started
+                print(f"… Batch {job.name}: {job.state.name} ({elapsed:.0f}s elapsed)")
+
+            if job.state.name != "JOB_STATE_SUCCEEDED":
+                raise RuntimeError(f"batch finished with {job.state.name}")
+
+            if uploaded is None:
+                for key, result in zip(keys, job.dest.inlined_responses):
+                    if result.response is not None and result.response.text:
+                        self._prefetched[key] = result.response.text
+            else:
+                data = await asyncio.to_thread(self.client.files.download, file=job.dest.file_name)
+                # Not splitlines(): that also breaks on U+2028 and friends inside strings.
+                for line in data.decode("utf-8").split("\n"):
+                    if line.strip():
+                        self._store_batch_line(json.loads(line))
+
         except Exception as e:
-            raise RuntimeError("Gemini API call failed") from e
+            # Anything not prefetched is simply requested online afterwards.
+            print(f"✗ Batch request failed, falling back to online requests: {e}")
+
+        finally:
+            os.unlink(jsonl_path)
+            if uploaded is not None:
+                try:
+                    await self.client.aio.files.delete(name=uploaded.name)
+                except Exception:
+                    pass  # uploaded files expire on their own
+
+        return owners
+
+    def _store_batch_line(self, line: Dict):
+        """Keep the text of one result line from a file-based batch job."""
+        candidates = (line.get("response") or {}).get("candidates") or []
+        if not candidates:
+            return
+
+        parts = (candidates[0].get("content") or {}).get("parts") or []
+        text = "".join(part.get("text", "") for part in parts)
+        if text:
+            self._prefetched[line["key"]] = text
 
     # ---------------- RESPONSE PARSER ---------------- #
 
+    def _parse_empty_review(self, response: str, file_path: str) -> Optional[CodeReview]:
+        text = response.strip()
+        if text.startswith("```"):
+            # Drop an opening ```/```json fence line and the closing fence.
+            text = text[text.find("\n") + 1:] if "\n" in text else ""
+            if text.rstrip().endswith("```"):
+                text = text.rstrip()[:-3].strip()
+
+        match = _EMPTY_REVIEW_RE.fullmatch(text)
+        if match is None:
+            return None
+
+        return CodeReview(
+            file_path=file_path,
+            issues=[],
+            suggestions=[],
+            quality_score=max(0, min(100, int(match.group(1)))),
+            summary=json.loads(match.group(2)),
+        )
+
     def _parse_response(self, response: str, file_path: str) -> CodeReview:
         try:
-            match = re.search(r"\{[\s\S]*\}", response)
-            if not match:
+            review = self._parse_empty_review(response, file_path)
+            if review is not None:
+                self.parse_stats["fast"] += 1
+                return review
+            self.parse_stats["full"] += 1
+
+            match = _JSON_START_RE.search(response)
+            start = match.start() if match else response.find("{")
+            if start < 0:
                 raise ValueError("No JSON object found in Gemini response")
 
-            data = json.loads(match.group())
+            # Decode in place from the first brace; trailing text is ignored.
+            data, _ = _JSON_DECODER.raw_decode(response, start)
 
             score = int(data.get("quality_score", 0))
             score = max(0, min(100, score))
@@ -82,130 +849,265 @@ class AICodeReviewer:
                 suggestions=[],
                 quality_score=0,
                 summary="Invalid Gemini response",
+                parse_failed=True,
             )
 
     # ---------------- REVIEW ROUTER ---------------- #
 
-    def review_code(
+    async def review_code(
         self,
         code: str,
         file_path: str,
         review_type: ReviewType = ReviewType.DETAILED,
     ) -> CodeReview:
         if review_type == ReviewType.QUICK:
-            return self._quick_review(code, file_path)
+            return await self._quick_review(code, file_path)
         if review_type == ReviewType.SECURITY:
-            return self._security_review(code, file_path)
-        return self._detailed_review(code, file_path)
+            return await self._security_review(code, file_path)
+        return await self._detailed_review(code, file_path)
 
     # ---------------- PROMPT BUILDER ---------------- #
 
-    def _build_prompt(self, code: str, file_path: str, focus: str) -> str:
-        return f"""
-You are an expert software reviewer.
+    def _build_prompt(self, code: str, file_path: str) -> str:
+        return _PROMPT_BODY_TEMPLATE.format(file_path=file_path, code=code)
 
-Focus: {focus}
+    def _build_chunk_prompt(
+        self, chunk: Chunk, part: int, parts: int, file_path: str, imports: str
+    ) -> str:
+        first_line, code = chunk
+        return _PROMPT_CHUNK_TEMPLATE.format(
+            file_path=file_path,
+            part=part,
+            parts=parts,
+            first_line=first_line,
+            last_line=first_line + len(_source_lines(code)) - 1,
+            context=_PROMPT_CONTEXT_TEMPLATE.format(imports=imports) if imports else "",
+            code=code,
+        )
 
-File: {file_path}
+    # ---------------- REVIEW TYPES ---------------- #
 
-Code:
+    def _review_prompts(self, code: str, file_path: str) -> List[Tuple[Chunk, str]]:
+        """Prompt bodies for a file as (chunk, body); one per chunk if split."""
+        chunks, imports = _split_for_review(code, file_path)
+        if len(chunks) == 1:
+            return [((1, code), self._build_prompt(code, file_path))]
 
-Return ONLY raw JSON.
-Do NOT include markdown, explanations, or commentary.
+        return [
+            (chunk, self._build_chunk_prompt(chunk, part, len(chunks), file_path, imports))
+            for part, chunk in enumerate(chunks, 1)
+        ]
 
-Required JSON format:
-{{
-  "issues": [
-    {{
-      "type": "security|bug|style|performance",
-      "line": 10,
-      "message": "description",
-      "severity": "low|medium|high|critical",
-      "cwe": "CWE-XXX"
-    }}
-  ],
-  "suggestions": [
-    {{
-      "category": "security|performance|style",
-      "message": "suggestion text",
-      "priority": "low|medium|high"
-    }}
-  ],
-  "quality_score": 85,
-  "summary": "short summary"
-}}
-"""
+    async def _run_review(self, code: str, file_path: str, review_type: ReviewType) -> CodeReview:
+        prompts = self._review_prompts(code, file_path)
 
-    # ---------------- REVIEW TYPES ---------------- #
+        async def _review_part(body: str) -> CodeReview:
+            text, cached = await self._call_gemini(review_type, body)
+            review = self._parse_response(text, file_path)
+
+            # Only responses that parsed are worth keeping; a bad reply is retried next run.
+            if self.cache is not None:
+                key = self._response_key(review_type, body)
+                if review.parse_failed:
+                    self.cache.discard(key)
+                elif not cached:
+                    self.cache.set(key, text)
+            return review
+
+        if len(prompts) == 1:
+            return await _review_part(prompts[0][1])
+
+        reviews = await asyncio.gather(*[_review_part(body) for _, body in prompts])
+        return _merge_reviews(file_path, [(chunk, r) for (chunk, _), r in zip(prompts, reviews)])
 
-    def _quick_review(self, code: str, file_path: str) -> CodeReview:
-        prompt = self._build_prompt(code, file_path, "Quick overall review")
-        return self._parse_response(self._call_gemini(prompt), file_path)
+    async def _quick_review(self, code: str, file_path: str) -> CodeReview:
+        return await self._run_review(code, file_path, ReviewType.QUICK)
 
-    def _detailed_review(self, code: str, file_path: str) -> CodeReview:
-        prompt = self._build_prompt(code, file_path, "Detailed quality and design review")
-        return self._parse_response(self._call_gemini(prompt), file_path)
+    async def _detailed_review(self, code: str, file_path: str) -> CodeReview:
+        return await self._run_review(code, file_path, ReviewType.DETAILED)
 
-    def _security_review(self, code: str, file_path: str) -> CodeReview:
-        prompt = self._build_prompt(code, file_path, "Strict security vulnerability review")
-        return self._parse_response(self._call_gemini(prompt), file_path)
+    async def _security_review(self, code: str, file_path: str) -> CodeReview:
+        return await self._run_review(code, file_path, ReviewType.SECURITY)
 
     # ---------------- DIRECTORY REVIEW ---------------- #
 
-    def review_directory(self, directory: str, extensions: List[str]) -> List[CodeReview]:
-        reviews: List[CodeReview] = []
+    async def _load_source(
+        self, path: str, review_type: ReviewType
+    ) -> Tuple[os.stat_result, Optional[CodeReview], str, bytes]:
+        """Return (stat, indexed review, code, digest); code is only read on an index miss."""
+        # Unchanged files (same mtime and size) are answered from the index unread.
+        stat = os.stat(path)
+        if self.index is not None:
+            review = self.index.get(path, review_type, self.model, stat)
+            if review is not None:
+                return stat, review, "", b""
 
-        for root, _, files in os.walk(directory):
-            for file in files:
-                if any(file.endswith(ext) for ext in extensions):
-                    path = os.path.join(root, file)
-                    try:
-                        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-                            code = f.read()
+        code, digest = await asyncio.to_thread(_read_source, path)
+        return stat, None, code, digest
 
-                        review = self.review_code(code, path)
-                        reviews.append(review)
-                        print(f"✓ Reviewed {path}: {review.quality_score}/100")
+    async def review_file(
+        self,
+        path: str,
+        review_type: ReviewType = ReviewType.DETAILED,
+    ) -> CodeReview:
+        stat, review, code, _ = await self._load_source(path, review_type)
+        if review is not None:
+            return review
+
+        review = await self.review_code(code, path, review_type)
+        if self.index is not None:
+            self.index.set(path, review_type, self.model, stat, review)
+        return review
+
+    async def review_directory(
+        self,
+        directory: str,
+        extensions: List[str],
+        review_type: ReviewType = ReviewType.DETAILED,
+        batch: bool = False,
+        batch_timeout: float = BATCH_MAX_WAIT_SECONDS,
+    ) -> List[CodeReview]:
+        # str.endswith accepts a tuple and checks every suffix in a single C call.
+        paths = list(_iter_source_files(directory, tuple(extensions)))
+
+        # In batch mode all uncached prompts go out as one batch job first; the
+        # per-file pass below then picks the results up from the prefetch map.
+        owners: Dict[bytes, str] = {}
+        if batch:
+            owners = await self._prefetch_batch(paths, review_type, batch_timeout)
+
+        # Identical contents are reviewed once; later paths share the same task.
+        seen: Dict[bytes, "asyncio.Task[CodeReview]"] = {}
+
+        # A file's contents are held from read until its review finishes, so this
+        # caps how many files sit in memory ahead of the request slots.
+        load_slots = asyncio.Semaphore(self.concurrency)
 
-                    except Exception as e:
-                        print(f"✗ Error reviewing {path}: {e}")
+        async def _review_one(path: str) -> Optional[CodeReview]:
+            try:
+                async with load_slots:
+                    stat, review, code, digest = await self._load_source(path, review_type)
+                    if review is not None:
+                        print(f"✓ Reviewed {path}: {review.quality_score}/100 (cached)")
+                        return review
 
-        return reviews
+                    task = seen.get(digest)
+                    duplicate = task is not None
+                    if not duplicate:
+                        # Review under the path the batch used, so its prompts match.
+                        task = seen[digest] = asyncio.ensure_future(
+                            self.review_code(code, owners.get(digest, path), review_type)
+                        )
+                        review = await task
+                    code = None
+
+                # Duplicates wait for the original without holding a load slot.
+                if duplicate:
+                    review = await task
+                if review.file_path != path:
+                    review = replace(review, file_path=path)
+
+                if self.index is not None:
+                    self.index.set(path, review_type, self.model, stat, review)
+
+                print(f"✓ Reviewed {path}: {review.quality_score}/100")
+                return review
+
+            except Exception as e:
+                print(f"✗ Error reviewing {path}: {e}")
+                return None
+
+        results = await asyncio.gather(*[_review_one(p) for p in paths])
+        return [r for r in results if r is not None]
 
     # ---------------- REPORT ---------------- #
 
-    def generate_report(self, reviews: List[CodeReview], output_file: str):
-        with open(output_file, "w", encoding="utf-8") as f:
-            f.write("# Code Review Report\n\n")
-            f.write(f"Files reviewed: {len(reviews)}\n\n")
+    def _report_chunks(self, reviews: List[CodeReview]) -> Iterator[bytes]:
+        yield b"# Code Review Report\n\n"
+        yield f"Files reviewed: {len(reviews)}\n\n".encode("utf-8")
+
+        scores = sorted(r.quality_score for r in reviews)
+        avg = sum(scores) / len(scores) if scores else 0
+        yield f"Average Score: {avg:.1f}/100\n\n".encode("utf-8")
 
-            avg = sum(r.quality_score for r in reviews) / len(reviews) if reviews else 0
-            f.write(f"Average Score: {avg:.1f}/100\n\n---\n\n")
+        if scores:
+            p50, p90 = _percentile(scores, 50), _percentile(scores, 90)
+            yield f"Score Percentiles: p50 {p50:.1f}, p90 {p90:.1f}\n\n".encode("utf-8")
 
-            for r in reviews:
-                f.write(f"## {r.file_path}\n\n")
-                f.write(f"Score: {r.quality_score}/100\n\n")
-                f.write(f"{r.summary}\n\n")
+        yield b"---\n\n"
 
-                if r.issues:
-                    f.write("### Issues\n")
-                    for i in r.issues:
-                        f.write(f"- {i}\n")
-                    f.write("\n")
+        # One pre-joined chunk per review instead of one write per line.
+        for r in reviews:
+            parts = [_REVIEW_HEADER((r.file_path, r.quality_score, r.summary))]
+            if r.issues:
+                parts.append(_render_items("Issues", r.issues))
+            if r.suggestions:
+                parts.append(_render_items("Suggestions", r.suggestions))
+            parts.append("---\n\n")
+            yield "".join(parts).encode("utf-8")
 
-                if r.suggestions:
-                    f.write("### Suggestions\n")
-                    for s in r.suggestions:
-                        f.write(f"- {s}\n")
-                    f.write("\n")
+    def generate_report(
+        self, reviews: List[CodeReview], output_file: Union[str, os.PathLike, BinaryIO]
+    ):
+        """Write the markdown report to a path, or to an already-open binary writer."""
+        if not isinstance(output_file, (str, os.PathLike)):
+            output_file.writelines(self._report_chunks(reviews))
+            return
 
-                f.write("---\n\n")
+        with open(output_file, "wb", buffering=1 << 20) as f:
+            f.writelines(self._report_chunks(reviews))
 
-        print(f"\n✓ Report generated: {output_file}")
+        print(f"\n✓ Report generated: {os.fspath(output_file)}")
 
 
 # ============================ CLI ============================ #
 
+async def _run(args):
+    cache = None
+    index = None
+    if not args.no_cache:
+        ttl = args.cache_ttl if args.cache_ttl > 0 else None
+        cache = ResponseCache(ttl=ttl)
+        index = ReviewIndex(ttl=ttl)
+
+    reviewer = AICodeReviewer(
+        cache=cache, concurrency=args.concurrency, index=index, model=args.model
+    )
+    review_type = ReviewType(args.type)
+
+    try:
+        if os.path.isfile(args.path):
+            review = await reviewer.review_file(args.path, review_type)
+            await asyncio.to_thread(reviewer.generate_report, [review], args.output)
+            print(f"\n✓ Review complete ({review.quality_score}/100)")
+
+        elif os.path.isdir(args.path):
+            extensions = args.extensions or [".py", ".js", ".java", ".cpp", ".c", ".go", ".rs"]
+            reviews = await reviewer.review_directory(
+                args.path,
+                extensions,
+                review_type,
+                batch=args.batch,
+                batch_timeout=args.batch_timeout,
+            )
+            await asyncio.to_thread(reviewer.generate_report, reviews, args.output)
+            print(f"\n✓ Reviewed {len(reviews)} files")
+
+        else:
+            print("Invalid path")
+
+    finally:
+        await reviewer.aclose()
+        if cache is not None:
+            cache.save()
+            print(f"Cache: {cache.stats['hits']} hits, {cache.stats['misses']} misses")
+        if index is not None:
+            index.close()
+            print(f"Index: {index.stats['hits']} hits, {index.stats['misses']} misses")
+        stats = reviewer.parse_stats
+        print(f"Parse: {stats['fast']} fast-path, {stats['full']} full decodes")
+
+
 def main():
     import argparse
 
@@ -214,29 +1116,39 @@ def main():
     parser.add_argument("--type", choices=["quick", "detailed", "security"], default="detailed")
     parser.add_argument("--output", default="review_report.md")
     parser.add_argument("--extensions", nargs="+")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the response cache and per-file index")
+    parser.add_argument(
+        "--cache-ttl",
+        type=float,
+        default=7 * 24 * 3600,
+        help="Seconds before a cached response or indexed review expires (<= 0 never expires)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Maximum concurrent Gemini requests",
+    )
+    parser.add_argument(
+        "--model",
+        default=DEFAULT_MODEL,
+        help="Gemini model, e.g. gemini-2.5-flash-lite for cheaper directory runs",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Submit directory reviews as one Gemini batch job (cheaper, slower to finish)",
+    )
+    parser.add_argument(
+        "--batch-timeout",
+        type=float,
+        default=BATCH_MAX_WAIT_SECONDS,
+        help="Seconds to wait for a batch job before reviewing the rest online",
+    )
 
     args = parser.parse_args()
-
-    reviewer = AICodeReviewer()
-    review_type = ReviewType(args.type)
-
-    if os.path.isfile(args.path):
-        with open(args.path, "r", encoding="utf-8", errors="ignore") as f:
-            code = f.read()
-
-        review = reviewer.review_code(code, args.path, review_type)
-        reviewer.generate_report([review], args.output)
-        print(f"\n✓ Review complete ({review.quality_score}/100)")
-
-    elif os.path.isdir(args.path):
-        extensions = args.extensions or [".py", ".js", ".java", ".cpp", ".c", ".go", ".rs"]
-        reviews = reviewer.review_directory(args.path, extensions)
-        reviewer.generate_report(reviews, args.output)
-        print(f"\n✓ Reviewed {len(reviews)} files")
-
-    else:
-        print("Invalid path")
+    asyncio.run(_run(args))
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()